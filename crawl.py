@@ -4,14 +4,29 @@ import json
 import logging
 import asyncio
 from datetime import datetime
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Dict, List, Optional, Any, Tuple, AsyncIterator
 import os
 import re
+import time
+import random
+import hashlib
+from contextlib import asynccontextmanager
+from functools import lru_cache
 
-from playwright.async_api import async_playwright, Page, ElementHandle, TimeoutError
+from playwright.async_api import async_playwright, Page, TimeoutError, Error as PlaywrightError
 from mongodb import MongoDBClient
 from notification_service import NotificationService, NotificationData
 
+try:
+    import orjson
+except ImportError:  # orjson is an optional speedup; fall back to stdlib json
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:  # uvloop is optional and not available on Windows
+    uvloop = None
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -19,11 +34,88 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Patterns used while extracting table data, compiled once at import
+_WHITESPACE_RE = re.compile(r'\s+')
+_NO_SLOTS_RE = re.compile(r'no availability|notify', re.IGNORECASE)
+# "notify me" in any case, without lowercasing the earliest-available cell
+_NOTIFY_ME_RE = re.compile(r'notify me', re.IGNORECASE)
+_LIST_SEP_RE = re.compile(r'\s*,\s*')
+
+# Lowercase month abbreviations, indexed by month number - 1
+_MONTH_ABBR = ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec")
+# A "<day> <Mon>" date such as "12 Mar"
+_DATE_RE = re.compile(r'\d{1,2}\s+(?:' + "|".join(_MONTH_ABBR) + r')', re.IGNORECASE)
+
+def month_label(start_month: int, offset: int) -> str:
+    """Upper-case abbreviation of the month `offset` months after `start_month` (1-12)."""
+    return _MONTH_ABBR[(start_month - 1 + offset) % 12].upper()
+
+def find_date(text: str) -> Optional[str]:
+    """Return the first "<day> <Mon>" date in text (e.g. "12 Mar"), or None."""
+    match = _DATE_RE.search(text)
+    return match.group(0) if match else None
+
+def content_hash(city_data: Dict[str, Any]) -> str:
+    """Hash the availability content of a city snapshot, ignoring its timestamp."""
+    content = [city_data.get("countries", []), city_data.get("temporarily_unavailable", [])]
+    if orjson is not None:
+        encoded = orjson.dumps(content, option=orjson.OPT_SORT_KEYS)
+    else:
+        encoded = json.dumps(content, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+# Notification text shared by every change type
+_CHANGE_HEADER = "New slots available for {country} in {city}!\n"
+
+@lru_cache(maxsize=1024)
+def format_slot_lines(slots: Tuple[Tuple[str, Optional[str]], ...]) -> str:
+    """Render "- MONTH: slots" lines for the months that have slots; slot sets repeat across users and cycles."""
+    return "".join(f"- {month}: {count}\n" for month, count in slots if count)
+
+@lru_cache(maxsize=256)
+def split_country_label(label: str) -> Tuple[str, str]:
+    """Split a cleaned "Country 🇨🇾" label into country name and flag."""
+    country_name, sep, flag = label.rpartition(" ")
+    if not sep:
+        return label, ""
+    return country_name, flag
+
+def dumps(obj: Any, indent: bool = False) -> str:
+    """Serialize obj to a JSON string, using orjson when it is available."""
+    if orjson is not None:
+        option = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=str, option=option).decode()
+    return json.dumps(obj, indent=2 if indent else None, default=str)
+
+class TokenBucket:
+    """Async token bucket allowing `rate` acquisitions per second, with bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Wait until a token is available and take it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
 class SchengenAppointmentCrawler:
     """Crawler for schengenappointments.com to extract appointment availability data."""
     
     BASE_URL = "https://schengenappointments.com/in"
-    CITIES = [
+    CITIES = (
         "dublin",
         "edmonton",
         "cardiff",
@@ -33,14 +125,73 @@ class SchengenAppointmentCrawler:
         "new-york",
         "toronto",
         "dubai"
-    ]
+    )
+    
+    # Selectors for the appointments table, shared by every city extraction
+    # A data row's country link; it only exists once the table's rows have been rendered
+    DATA_ROW_SELECTOR = "table tbody tr a"
+    ROW_SELECTOR = "table tbody tr"
+    HEADER_SELECTOR = "table thead th"
+    CELL_SELECTOR = "td, th"
+    UNAVAILABLE_SELECTOR = "div.alert-warning"
+    
+    # Runs in the page and returns the text extract_city_data needs as plain data:
+    # header cells, each row's class, cell texts and first-cell link text, and the warning box
+    EXTRACT_SCRIPT = """
+    ([headerSelector, rowSelector, cellSelector, unavailableSelector]) => {
+        const rows = Array.from(document.querySelectorAll(rowSelector), row => {
+            const cells = Array.from(row.querySelectorAll(cellSelector));
+            const link = cells.length ? cells[0].querySelector("a") : null;
+            return {
+                className: row.getAttribute("class"),
+                cells: cells.map(cell => cell.textContent),
+                link: link ? link.textContent : null
+            };
+        });
+        const unavailable = document.querySelector(unavailableSelector);
+        return {
+            headers: Array.from(document.querySelectorAll(headerSelector), th => th.textContent),
+            rows,
+            unavailable: unavailable ? unavailable.textContent : null
+        };
+    }
+    """
+    
+    # Chromium flags: images are never needed to read the table, so skip loading them. This is
+    # done with a Blink setting rather than request routing, which would disable the HTTP cache
+    BROWSER_ARGS = ['--no-sandbox', '--blink-settings=imagesEnabled=false']
     
     def __init__(self):
+        self.playwright = None
         self.browser = None
         self.context = None
         self.debug_dir = "debug_output"
         self.mongodb = MongoDBClient()
         self.notification_service = NotificationService()
+        self.last_cycle_count = 0
+        self.cycle_change_count = 0
+        # Set for the duration of crawl_cities so every record in a cycle shares one timestamp
+        self.cycle_time: Optional[datetime] = None
+        self.cycle_timestamp: Optional[str] = None
+        self.city_timeout = float(os.getenv("CRAWLER_CITY_TIMEOUT", "60"))
+        self.concurrency = max(1, int(os.getenv("CRAWLER_CONCURRENCY", "3")))
+        self.goto_attempts = max(1, int(os.getenv("CRAWLER_GOTO_ATTEMPTS", "3")))
+        # Navigations per second against the site, shared by all pages; 0 disables the limit
+        rate = float(os.getenv("CRAWLER_RATE", "2"))
+        self.rate_limiter = TokenBucket(rate, capacity=self.concurrency) if rate > 0 else None
+        # Per-city circuit breaker: after repeated failures a city is skipped for a cool-down
+        self.breaker_threshold = max(1, int(os.getenv("CRAWLER_BREAKER_THRESHOLD", "3")))
+        self.breaker_cooldown = float(os.getenv("CRAWLER_BREAKER_COOLDOWN", "300"))
+        self._city_failures: Dict[str, int] = {}
+        self._city_open_until: Dict[str, float] = {}
+        # Content hash and write time of each city's last saved snapshot, to skip unchanged cities
+        self.snapshot_refresh = float(os.getenv("CRAWLER_SNAPSHOT_REFRESH", "3600"))
+        self._snapshot_hashes: Dict[str, Tuple[str, float]] = {}
+        # Change-detection view of each city's last saved snapshot; this process is the only
+        # writer, so after the first cycle it replaces the per-cycle MongoDB preload
+        self._last_snapshots: Dict[str, Dict[str, Any]] = {}
+        # City page URLs are fixed for the process lifetime
+        self.city_urls = {city: f"{self.BASE_URL}/{city}/tourism" for city in self.CITIES}
         os.makedirs(self.debug_dir, exist_ok=True)
     
     async def setup(self):
@@ -55,11 +206,11 @@ class SchengenAppointmentCrawler:
                 raise Exception("Failed to initialize MongoDB collections")
             
             # Initialize browser
-            playwright = await async_playwright().start()
+            self.playwright = await async_playwright().start()
             logger.info("Starting browser...")
-            self.browser = await playwright.chromium.launch(
+            self.browser = await self.playwright.chromium.launch(
                 headless=True,
-                args=['--no-sandbox']
+                args=self.BROWSER_ARGS
             )
             self.context = await self.browser.new_context(
                 user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36'
@@ -69,6 +220,10 @@ class SchengenAppointmentCrawler:
             logger.error(f"Failed to setup: {str(e)}")
             raise
     
+    def is_healthy(self) -> bool:
+        """Return True while the browser context is set up and its browser is still connected."""
+        return self.context is not None and self.browser is not None and self.browser.is_connected()
+    
     async def teardown(self):
         """Close browser and context."""
         try:
@@ -76,12 +231,17 @@ class SchengenAppointmentCrawler:
                 await self.context.close()
             if self.browser:
                 await self.browser.close()
+            # Stop the driver process too, or every recycled crawler leaves one behind
+            if self.playwright:
+                await self.playwright.stop()
+                self.playwright = None
             
             # Cleanup old data before closing
             deleted_count = await self.mongodb.cleanup_old_data()
             if deleted_count > 0:
                 logger.info(f"Cleaned up {deleted_count} old records during teardown")
             
+            await self.notification_service.close()
             await self.mongodb.close()
             logger.info("Browser and MongoDB connections closed successfully")
         except Exception as e:
@@ -98,158 +258,297 @@ class SchengenAppointmentCrawler:
             logger.error(f"Error getting stats for {city}: {str(e)}")
             return {"error": str(e)}
 
-    async def notify_users_of_changes(self, changes: List[Dict[str, Any]]) -> None:
+    @staticmethod
+    def format_change_message(change: Dict[str, Any]) -> str:
+        """Render the notification text for a single slot change."""
+        header = _CHANGE_HEADER.format(country=change["country"], city=change["city"])
+        if change["change_type"] == "new_country":
+            body = "Available slots:\n" + format_slot_lines(tuple(change["current_slots"].items()))
+        else:
+            body = f"Month: {change['month']}\nAvailable slots: {change['current_slots']}\n"
+        return f"{header}{body}\nBook now at: {change['url']}"
+
+    async def notify_users_of_changes(
+        self,
+        changes: List[Dict[str, Any]],
+        subscriptions: Optional[Dict[Tuple[str, str], List[Dict[str, Any]]]] = None
+    ) -> None:
         """
         Notify users about slot availability changes.
+        
+        Changes are grouped per user so each subscriber gets one notification
+        covering every change that concerns them, rather than one per month.
+        subscriptions holds active users keyed by (city, country) as prefetched
+        for the current cycle; without it subscribers are queried per change.
         """
-        for change in changes:
+        # Indexes of the changes each (email, phone) subscriber should hear about
+        per_user: Dict[Tuple[Optional[str], Optional[str]], List[int]] = {}
+        messages: Dict[int, str] = {}
+        
+        for i, change in enumerate(changes):
             try:
                 # Get active subscribers for this city/country combination
-                active_users = await self.mongodb.get_active_subscriptions(
-                    city=change["city"],
-                    country=change["country"]
-                )
+                if subscriptions is not None:
+                    active_users = subscriptions.get((change["city"], change["country"]), [])
+                else:
+                    active_users = await self.mongodb.get_active_subscriptions(
+                        city=change["city"],
+                        country=change["country"]
+                    )
                 
                 if not active_users:
-                    logger.info(f"No active subscribers for {change['city']}/{change['country']}")
+                    logger.debug("No active subscribers for %s/%s", change['city'], change['country'])
                     continue
                 
-                # Prepare notification message
-                if change["change_type"] == "new_country":
-                    message = (
-                        f"New slots available for {change['country']} in {change['city']}!\n"
-                        f"Available slots:\n"
-                    )
-                    for month, slots in change["current_slots"].items():
-                        if slots:
-                            message += f"- {month}: {slots}\n"
-                else:
-                    message = (
-                        f"New slots available for {change['country']} in {change['city']}!\n"
-                        f"Month: {change['month']}\n"
-                        f"Available slots: {change['current_slots']}\n"
-                    )
-                
-                message += f"\nBook now at: {change['url']}"
+                messages[i] = self.format_change_message(change)
+                for user in active_users:
+                    per_user.setdefault((user.get("email"), user.get("phone")), []).append(i)
                 
-                # Create notification data
+            except Exception as e:
+                logger.error("Error processing notifications for change %s: %s", change, e)
+        
+        # Notify each active user once
+        for (email, phone), indexes in per_user.items():
+            try:
+                user_changes = [changes[i] for i in indexes]
+                first = user_changes[0]
+                change_types = {c["change_type"] for c in user_changes}
                 notification_data = NotificationData(
-                    city=change["city"],
-                    country=change["country"],
-                    message=message,
-                    change_type=change["change_type"],
-                    url=change["url"],
-                    timestamp=datetime.utcnow()
+                    city=first["city"],
+                    country=", ".join(dict.fromkeys(c["country"] for c in user_changes)),
+                    message="\n\n".join(messages[i] for i in indexes),
+                    change_type=first["change_type"] if len(change_types) == 1 else "multiple",
+                    url=first["url"],
+                    timestamp=self.cycle_time or datetime.utcnow()
                 )
-                
-                # Notify each active user
-                for user in active_users:
-                    try:
-                        await self.notification_service.notify_user(
-                            email=user.get("email"),
-                            phone=user.get("phone"),
-                            data=notification_data
-                        )
-                        logger.info(f"Notified user {user.get('email')} about {change['city']}/{change['country']} availability")
-                    except Exception as e:
-                        logger.error(f"Failed to notify user {user.get('email')}: {e}")
-                
+                await self.notification_service.enqueue(email=email, phone=phone, data=notification_data)
+                logger.debug("Queued notification for user %s about %d changes in %s", email, len(user_changes), first["city"])
             except Exception as e:
-                logger.error(f"Error processing notifications for change {change}: {e}")
+                logger.error("Failed to queue notification for user %s: %s", email, e)
 
-    async def process_city_changes(self, city: str, city_data: Dict[str, Any]) -> None:
+    async def process_city_changes(
+        self,
+        city: str,
+        city_data: Dict[str, Any],
+        subscriptions: Optional[Dict[Tuple[str, str], List[Dict[str, Any]]]] = None,
+        previous_data: Optional[Dict[str, Any]] = None
+    ) -> None:
         """
         Process changes for a city and notify users if needed.
         """
         try:
             # Add base URL to the data for generating notification URLs
-            city_data["base_url"] = f"{self.BASE_URL}/{city}/tourism"
+            city_data["base_url"] = self.city_urls[city]
             
             # Detect changes in slot availability
-            changes = await self.mongodb.detect_slot_changes(city, city_data)
+            changes = await self.mongodb.detect_slot_changes(city, city_data, previous_data)
             
             if changes:
-                logger.info(f"Detected {len(changes)} changes for {city}")
-                await self.notify_users_of_changes(changes)
+                logger.debug("Detected %d changes for %s", len(changes), city)
+                self.cycle_change_count += len(changes)
+                await self.notify_users_of_changes(changes, subscriptions)
             else:
-                logger.info(f"No changes detected for {city}")
+                logger.debug("No changes detected for %s", city)
             
         except Exception as e:
             logger.error(f"Error processing changes for {city}: {e}")
 
-    async def crawl_cities(self) -> Dict[str, List[Dict[str, Any]]]:
-        """Main crawling function to extract data from all cities."""
-        result = {"cities": []}
+    async def goto_with_retry(self, page: Page, url: str) -> None:
+        """Navigate to url, retrying transient navigation failures with full-jitter backoff."""
+        for attempt in range(self.goto_attempts):
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire()
+            try:
+                # The table rows are awaited by selector during extraction, so the DOM is enough here
+                await page.goto(url, wait_until='domcontentloaded', timeout=15000)
+                return
+            except PlaywrightError as e:
+                # A closed page or disconnected browser will not recover by retrying
+                if attempt == self.goto_attempts - 1 or page.is_closed() or not self.is_healthy():
+                    raise
+                delay = random.uniform(0, 0.5 * 2 ** attempt)
+                logger.warning("Navigation to %s failed (%s), retrying in %.1fs", url, e, delay)
+                await asyncio.sleep(delay)
+
+    async def load_city_data(self, page: Page, city: str, city_url: str) -> Optional[Dict[str, Any]]:
+        """Navigate to a city page and extract its appointment data."""
+        # extract_city_data waits for the table itself, so no fixed settle delay is needed
+        await self.goto_with_retry(page, city_url)
+        return await self.extract_city_data(page, city)
+
+    @asynccontextmanager
+    async def acquire_page(self, pages: "asyncio.Queue[Page]") -> AsyncIterator[Page]:
+        """Borrow a page from the pool, returning it (or a replacement if it closed) afterwards."""
+        page = await pages.get()
+        try:
+            yield page
+        finally:
+            if page.is_closed() and self.is_healthy():
+                try:
+                    page = await self.context.new_page()
+                except PlaywrightError as e:
+                    # Keep the pool size; the dead page fails fast for the next city
+                    logger.warning("Could not replace closed page: %s", e)
+            pages.put_nowait(page)
+
+    def _circuit_allows(self, city: str) -> bool:
+        """Return False while the city's breaker is open; allow a trial request once it cools down."""
+        return time.monotonic() >= self._city_open_until.get(city, 0.0)
+
+    def _record_city_failure(self, city: str) -> None:
+        """Count a failed load and open the city's breaker once the threshold is reached."""
+        failures = self._city_failures.get(city, 0) + 1
+        self._city_failures[city] = failures
+        if failures >= self.breaker_threshold:
+            self._city_open_until[city] = time.monotonic() + self.breaker_cooldown
+            logger.warning(
+                "Circuit opened for %s after %d consecutive failures; skipping it for %.0fs",
+                city, failures, self.breaker_cooldown
+            )
+
+    def _record_city_success(self, city: str) -> None:
+        """Close the city's breaker after a successful load."""
+        self._city_failures.pop(city, None)
+        self._city_open_until.pop(city, None)
+
+    async def crawl_city(
+        self,
+        city: str,
+        pages: "asyncio.Queue[Page]",
+        subscriptions: Dict[Tuple[str, str], List[Dict[str, Any]]],
+        previous_data: Optional[Dict[str, Any]],
+        has_subscribers: bool = True
+    ) -> Optional[Dict[str, Any]]:
+        """Crawl and process a single city using a page from the pool; returns its data to save."""
+        try:
+            if not self._circuit_allows(city):
+                logger.info("Skipping %s: circuit open after repeated failures", city)
+                return None
+            
+            city_url = self.city_urls[city]
+            logger.debug("Processing city: %s at %s", city, city_url)
+            
+            # Hold a page only while the browser is needed
+            try:
+                async with self.acquire_page(pages) as page:
+                    # Bound the page work so one stuck city cannot stall the cycle
+                    city_data = await asyncio.wait_for(
+                        self.load_city_data(page, city, city_url),
+                        timeout=self.city_timeout
+                    )
+            except asyncio.TimeoutError:
+                logger.warning(f"Timed out after {self.city_timeout:.0f}s processing city {city}")
+                self._record_city_failure(city)
+                return None
+            except Exception:
+                self._record_city_failure(city)
+                raise
+            
+            if not city_data:
+                self._record_city_failure(city)
+                return None
+            self._record_city_success(city)
+            
+            # Identical content means no changes to detect and nothing new to store,
+            # but rewrite periodically so the latest snapshot outlives data retention
+            digest = content_hash(city_data)
+            now = time.monotonic()
+            last = self._snapshot_hashes.get(city)
+            if last and last[0] == digest and now - last[1] < self.snapshot_refresh:
+                logger.debug("No content changes for %s, skipping detection and save", city)
+                return None
+            
+            # Process changes and notify users against the preloaded previous snapshot;
+            # with nobody to notify the snapshot is still saved but not diffed
+            if has_subscribers:
+                await self.process_city_changes(city, city_data, subscriptions, previous_data)
+            else:
+                logger.debug("No subscribers for %s, skipping change detection", city)
+            self._snapshot_hashes[city] = (digest, now)
+            return city_data
+            
+        except Exception as e:
+            logger.error(f"Error processing city {city}: {str(e)}")
+            return None
+
+    async def crawl_cities(self) -> int:
+        """Main crawling function to extract data from all cities.
+
+        Cities are crawled concurrently, bounded by a pool of CRAWLER_CONCURRENCY
+        pages, and saved with a single bulk write at the end of the cycle.
+        Returns the number of cities whose data was saved in this cycle.
+        """
+        pages: "asyncio.Queue[Page]" = asyncio.Queue()
+        self.cycle_time = datetime.utcnow()
+        self.cycle_timestamp = self.cycle_time.isoformat() + "Z"
+        self.cycle_change_count = 0
         
         try:
-            page = await self.context.new_page()
+            # Fetch subscribers and previous snapshots once per cycle instead of per city
+            subscriptions = await self.mongodb.get_active_subscriptions_by_city(self.CITIES)
+            missing = [city for city in self.CITIES if city not in self._last_snapshots]
+            if missing:
+                self._last_snapshots.update(await self.mongodb.get_last_appointment_data_many(
+                    missing, self.mongodb.CHANGE_DETECTION_PROJECTION
+                ))
+            previous_snapshots = self._last_snapshots
             
-            for city in self.CITIES:
-                try:
-                    city_url = f"{self.BASE_URL}/{city}/tourism"
-                    logger.info(f"Processing city: {city} at {city_url}")
-                    
-                    # Navigate to the city page
-                    await page.goto(city_url, wait_until='networkidle', timeout=15000)
-                    await asyncio.sleep(1)  # Brief wait for dynamic content
-                    
-                    # Extract data for the city
-                    city_data = await self.extract_city_data(page, city)
-                    if city_data:
-                        # Process changes and notify users before saving
-                        await self.process_city_changes(city, city_data)
-                        
-                        # Save to MongoDB
-                        saved = await self.mongodb.save_appointment_data(city, city_data)
-                        if saved:
-                            logger.info(f"Saved data to MongoDB for {city}")
-                            result["cities"].append(city_data)
-                        else:
-                            logger.error(f"Failed to save data to MongoDB for {city}")
-                    
-                except Exception as e:
-                    logger.error(f"Error processing city {city}: {str(e)}")
-                    continue
+            for _ in range(min(self.concurrency, len(self.CITIES))):
+                pages.put_nowait(await self.context.new_page())
+            
+            # Shuffle the order each cycle so the same cities are not always first in line for pages
+            cities = random.sample(self.CITIES, len(self.CITIES))
+            subscribed_cities = {city for city, _ in subscriptions}
+            results = await asyncio.gather(*(
+                self.crawl_city(
+                    city, pages, subscriptions, previous_snapshots.get(city), city in subscribed_cities
+                )
+                for city in cities
+            ))
+            
+            # Save to MongoDB
+            city_data = {city: data for city, data in zip(cities, results) if data}
+            saved_count = await self.mongodb.save_appointment_data_many(city_data)
+            if saved_count < len(city_data):
+                logger.error(f"Saved data to MongoDB for {saved_count} of {len(city_data)} cities")
+                # Force a rewrite and a reload next cycle rather than trusting unsaved snapshots
+                self._snapshot_hashes.clear()
+                self._last_snapshots.clear()
+            else:
+                for city, data in city_data.items():
+                    self._last_snapshots[city] = {
+                        "available_slots": data["available_slots"],
+                        "countries": [{"country": c["country"]} for c in data["countries"]]
+                    }
             
         except Exception as e:
             logger.error(f"Error during crawling: {str(e)}")
+            self._snapshot_hashes.clear()
+            self._last_snapshots.clear()
             raise
+        finally:
+            while not pages.empty():
+                page = pages.get_nowait()
+                try:
+                    await page.close()
+                except Exception as e:
+                    logger.debug("Error closing page: %s", e)
+            self.cycle_time = None
+            self.cycle_timestamp = None
         
-        logger.info(f"Crawling completed. Found data for {len(result['cities'])} cities.")
-        return result
+        self.last_cycle_count = saved_count
+        # One summary line per cycle; per-city details are logged at DEBUG
+        logger.info(
+            "Crawling completed. Saved %d of %d cities (others unchanged or failed), %d slot changes detected.",
+            saved_count, len(self.CITIES), self.cycle_change_count
+        )
+        return saved_count
 
     async def clean_text(self, text: str) -> str:
         """Clean text by removing extra whitespace and newlines."""
         if not text:
             return ""
-        return re.sub(r'\s+', ' ', text).strip()
-
-    async def extract_country_info(self, country_col: ElementHandle) -> Tuple[str, str]:
-        """Extract country name and flag from a table cell."""
-        try:
-            # Get the link element that contains both country name and flag
-            country_link = await country_col.query_selector("a")
-            if not country_link:
-                return "", ""
-            
-            # Get the link text which contains both country name and flag
-            link_text = await country_link.text_content()
-            link_text = await self.clean_text(link_text)
-            
-            # Split into country name and flag (format: "Country 🇨🇾")
-            parts = link_text.split(" ")
-            if len(parts) < 2:
-                return link_text, ""
-            
-            # Last part is the flag emoji, everything before is the country name
-            flag = parts[-1]
-            country_name = " ".join(parts[:-1])
-            
-            return country_name, flag
-            
-        except Exception as e:
-            logger.error(f"Error extracting country info: {str(e)}")
-            return "", ""
+        return _WHITESPACE_RE.sub(' ', text).strip()
 
     async def extract_city_data(self, page: Page, city_name: str) -> Optional[Dict[str, Any]]:
         """Extract appointment data for a specific city."""
@@ -259,87 +558,83 @@ class SchengenAppointmentCrawler:
                 "city": city_name,
                 "countries": [],
                 "temporarily_unavailable": [],
-                "timestamp": datetime.utcnow().isoformat() + "Z"
+                "timestamp": self.cycle_timestamp or datetime.utcnow().isoformat() + "Z"
             }
             
-            # Get all rows from the tourist visa table
+            # Wait for the tourist visa table's data rows, not just the table element,
+            # so a table whose rows are still being filled in is not read as empty
             try:
-                # Wait for table with shorter timeout
-                await page.wait_for_selector("table", timeout=10000)
-                rows = await page.query_selector_all("table tbody tr")
-                
-                # Get month headers first
-                headers = await page.query_selector_all("table thead th")
-                month_names = []
-                for i in range(2, 5):  # MAY, JUN, JUL columns
-                    if i < len(headers):
-                        header = await headers[i].text_content()
-                        month_name = await self.clean_text(header)
-                        month_names.append(month_name.strip().upper()[:3])
-                    else:
-                        month_names.append(f"M{i-1}")
-                
+                await page.wait_for_selector(self.DATA_ROW_SELECTOR, timeout=10000)
             except TimeoutError:
-                logger.warning(f"No table found for {city_name}")
+                logger.warning(f"No table rows found for {city_name}")
                 return None
             
-            for row in rows:
+            # Read headers, row cells and the warning text in one round trip instead of one per cell
+            snapshot = await page.evaluate(
+                self.EXTRACT_SCRIPT,
+                [self.HEADER_SELECTOR, self.ROW_SELECTOR, self.CELL_SELECTOR, self.UNAVAILABLE_SELECTOR]
+            )
+            
+            # Get month headers first
+            headers = snapshot["headers"]
+            month_names = []
+            current_month = (self.cycle_time or datetime.utcnow()).month
+            for i in range(2, 5):  # Current month and the next two
+                if i < len(headers):
+                    month_name = await self.clean_text(headers[i])
+                    month_names.append(month_name[:3].upper())
+                else:
+                    # Missing header: derive the label so keys still match other snapshots
+                    month_names.append(month_label(current_month, i - 2))
+            
+            # Empty slot structure shared by every row of this city
+            empty_slots = dict.fromkeys(month_names)
+            
+            for row in snapshot["rows"]:
                 try:
                     # Skip rows that are just section headers
-                    row_class = await row.get_attribute("class")
+                    row_class = row["className"]
                     if row_class and "bg-error" in row_class:
                         continue
                     
-                    # Get all columns in the row
-                    cols = await row.query_selector_all("td, th")
-                    
                     # Skip if row doesn't have enough columns
-                    if len(cols) < 2:
+                    cols = row["cells"]
+                    if len(cols) < 2 or row["link"] is None:
                         continue
                     
-                    # Get country name and flag
-                    country_col = cols[0]
-                    country_name, flag = await self.extract_country_info(country_col)
+                    # Split the first cell's link text into country name and flag (format:
+                    # "Country 🇨🇾"); labels repeat across cities and cycles so the split is memoized
+                    country_name, flag = split_country_label(await self.clean_text(row["link"]))
                     
                     if not country_name:
                         continue
                     
-                    # Get earliest available date
-                    earliest_col = cols[1] if len(cols) > 1 else None
-                    earliest_text = await earliest_col.text_content() if earliest_col else None
-                    earliest_text = await self.clean_text(earliest_text) if earliest_text else None
+                    # Get earliest available date (rows with fewer than 2 columns were skipped above)
+                    earliest_text = await self.clean_text(cols[1])
                     
                     # Normalize availability text
-                    if earliest_text:
-                        if "No availability" in earliest_text:
-                            earliest_available = None
-                        elif "notify me" in earliest_text.lower():
-                            earliest_available = "🔔 Notify me"
-                        else:
-                            # Extract just the date part
-                            date_match = re.search(r'\d{1,2}\s+\w{3}', earliest_text)
-                            earliest_available = date_match.group(0) if date_match else earliest_text
-                    else:
+                    # "No availability" takes precedence when a cell also mentions "notify me"
+                    if not earliest_text or "No availability" in earliest_text:
                         earliest_available = None
+                    elif _NOTIFY_ME_RE.search(earliest_text):
+                        earliest_available = "🔔 Notify me"
+                    else:
+                        # Extract just the date part
+                        earliest_available = find_date(earliest_text) or earliest_text
                     
                     # Initialize consistent slot structure
-                    slots = {month: None for month in month_names}
+                    slots = empty_slots.copy()
                     
                     # Get slot counts for next 3 months
                     if len(cols) > 4:  # If we have month columns
-                        month_cols = cols[2:5]  # Next 3 months columns
-                        
-                        # Extract slot counts
-                        for i, col in enumerate(month_cols):
-                            month_text = await col.text_content()
+                        for i, month_text in enumerate(cols[2:5]):
                             month_text = await self.clean_text(month_text)
-                            month_name = month_names[i]
-                            
-                            if month_text and not any(x in month_text.lower() for x in ["no availability", "notify"]):
-                                slots[month_name] = month_text.strip()
+                            if month_text and not _NO_SLOTS_RE.search(month_text):
+                                slots[month_names[i]] = month_text
                     
                     # Add country data if we have either availability or slots
-                    if earliest_available or any(v is not None for v in slots.values()):
+                    # "0" means the month has no open slots
+                    if earliest_available is not None or any(v not in (None, "0") for v in slots.values()):
                         country_data = {
                             "country": country_name,
                             "flag": flag,
@@ -352,20 +647,15 @@ class SchengenAppointmentCrawler:
                     logger.error(f"Error processing row in {city_name}: {str(e)}")
                     continue
             
-            # Try to extract temporarily unavailable countries
-            try:
-                unavailable_section = await page.query_selector("div.alert-warning")
-                if unavailable_section:
-                    unavailable_text = await unavailable_section.text_content()
-                    if "Temporarily unavailable:" in unavailable_text:
-                        countries = unavailable_text.split(":")[-1].strip()
-                        if countries:
-                            city_data["temporarily_unavailable"] = [
-                                await self.clean_text(c) 
-                                for c in countries.split(",")
-                            ]
-            except Exception as e:
-                logger.debug(f"No temporarily unavailable countries found for {city_name}: {str(e)}")
+            # Extract temporarily unavailable countries
+            unavailable_text = snapshot["unavailable"]
+            if unavailable_text and "Temporarily unavailable:" in unavailable_text:
+                # Normalize whitespace once, then split the list in a single pass
+                countries = await self.clean_text(unavailable_text.rpartition(":")[2])
+                if countries:
+                    city_data["temporarily_unavailable"] = _LIST_SEP_RE.split(countries)
+            else:
+                logger.debug("No temporarily unavailable countries found for %s", city_name)
             
             return city_data
             
@@ -378,19 +668,21 @@ async def main():
     crawler = SchengenAppointmentCrawler()
     try:
         await crawler.setup()
-        result = await crawler.crawl_cities()
+        await crawler.crawl_cities()
         
-        # Get stats for each city after crawling
-        for city in crawler.CITIES:
-            try:
-                stats = await crawler.get_city_stats(city)
-                if "error" not in stats:
-                    logger.info(f"Stats for {city}:")
-                    logger.info(json.dumps(stats, indent=2))
-            except Exception as e:
-                logger.error(f"Error getting stats for {city}: {str(e)}")
+        # Stats are only logged, so skip the queries and the dumps when INFO is filtered out
+        if logger.isEnabledFor(logging.INFO):
+            for city in crawler.CITIES:
+                try:
+                    stats = await crawler.get_city_stats(city)
+                    if "error" not in stats:
+                        logger.info("Stats for %s:\n%s", city, dumps(stats, indent=True))
+                except Exception as e:
+                    logger.error(f"Error getting stats for {city}: {str(e)}")
     finally:
         await crawler.teardown()
 
 if __name__ == "__main__":
+    if uvloop is not None:
+        uvloop.install()
     asyncio.run(main()) 
\ No newline at end of file
@@ -1,11 +1,12 @@
-from typing import Dict, List, Optional, Any, Tuple
-from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any, Tuple, Sequence
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
 import os
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 from loguru import logger
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError, OperationFailure
-from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo import ASCENDING, DESCENDING, IndexModel, UpdateOne
 import backoff
 import json
 
@@ -40,11 +41,48 @@ APPOINTMENT_SCHEMA = {
         "temporarily_unavailable": {
             "bsonType": "array",
             "items": {"bsonType": "string"}
+        },
+        "available_slots": {
+            "bsonType": "array",
+            "items": {"bsonType": "string"}
         }
     }
 }
 
+def availability_keys(countries: List[Dict]) -> List[str]:
+    """
+    Build the sorted "country|month" keys of every month that has open slots.
+    Stored with each snapshot so change detection can diff two small sets.
+    """
+    return sorted(
+        f"{c['country']}|{month}"
+        for c in countries
+        for month, slots in c.get("slots", {}).items()
+        if slots not in (None, "0")
+    )
+
+def parse_utc_timestamp(value: str) -> datetime:
+    """
+    Parse an ISO 8601 timestamp into a naive UTC datetime.
+    Only a trailing "Z" is rewritten, so the rest of the string is not rescanned.
+    """
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        # Compare cleanly with datetime.utcnow(), which is naive
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+@lru_cache(maxsize=256)
+def country_slug(country: str) -> str:
+    """URL path segment for a country name, e.g. "Czech Republic" -> "czech-republic"."""
+    return country.lower().replace(' ', '-')
+
 class MongoDBClient:
+    # Only the availability vector and country names are needed to diff snapshots
+    CHANGE_DETECTION_PROJECTION = {"available_slots": 1, "countries.country": 1}
+
     def __init__(self):
         self.uri = os.getenv("MONGODB_URI")
         self.db_name = os.getenv("MONGODB_DB_NAME", "default")
@@ -105,6 +143,22 @@ class MongoDBClient:
             logger.error(f"MongoDB health check failed: {e}")
             return False
 
+    @staticmethod
+    def _prepare_appointment_data(city: str, data: Dict) -> Dict:
+        """Normalize appointment data in place before it is written."""
+        # Convert string timestamp to datetime if needed
+        if isinstance(data.get("timestamp"), str):
+            data["timestamp"] = parse_utc_timestamp(data["timestamp"])
+        elif "timestamp" not in data:
+            data["timestamp"] = datetime.utcnow()
+        
+        # Add city as a key field if not present
+        data["city"] = city
+        
+        # Persist the availability vector used by detect_slot_changes
+        data["available_slots"] = availability_keys(data.get("countries", []))
+        return data
+
     @backoff.on_exception(
         backoff.expo,
         (ConnectionFailure, ServerSelectionTimeoutError),
@@ -114,14 +168,7 @@ class MongoDBClient:
     async def save_appointment_data(self, city: str, data: Dict) -> bool:
         """Save appointment data to MongoDB using upsert operation with retry logic."""
         try:
-            # Convert string timestamp to datetime if needed
-            if isinstance(data.get("timestamp"), str):
-                data["timestamp"] = datetime.fromisoformat(data["timestamp"].replace("Z", "+00:00"))
-            elif "timestamp" not in data:
-                data["timestamp"] = datetime.utcnow()
-            
-            # Add city as a key field if not present
-            data["city"] = city
+            self._prepare_appointment_data(city, data)
             
             # Use update_one with upsert=True to update existing record or create new one
             await self.db[self.appointments_collection].update_one(
@@ -135,11 +182,39 @@ class MongoDBClient:
             logger.error(f"Error saving appointment data for {city}: {e}")
             return False
 
-    async def get_last_appointment_data(self, city: str) -> Optional[Dict]:
-        """Get the most recent appointment data for a city."""
+    @backoff.on_exception(
+        backoff.expo,
+        (ConnectionFailure, ServerSelectionTimeoutError),
+        max_tries=3,
+        max_time=30
+    )
+    async def save_appointment_data_many(self, city_data: Dict[str, Dict]) -> int:
+        """
+        Upsert appointment data for several cities in one unordered bulk write.
+        Returns the number of cities written.
+        """
+        if not city_data:
+            return 0
+        
+        try:
+            operations = [
+                UpdateOne({"city": city}, {"$set": self._prepare_appointment_data(city, data)}, upsert=True)
+                for city, data in city_data.items()
+            ]
+            result = await self.db[self.appointments_collection].bulk_write(operations, ordered=False)
+            saved = result.matched_count + result.upserted_count
+            logger.info(f"Updated appointment data for {saved} cities")
+            return saved
+        except Exception as e:
+            logger.error(f"Error saving appointment data for {list(city_data)}: {e}")
+            return 0
+
+    async def get_last_appointment_data(self, city: str, projection: Optional[Dict] = None) -> Optional[Dict]:
+        """Get the most recent appointment data for a city, optionally limited to projection fields."""
         try:
             result = await self.db[self.appointments_collection].find_one(
                 {"city": city},
+                projection,
                 sort=[("timestamp", -1)]
             )
             return result
@@ -147,6 +222,22 @@ class MongoDBClient:
             logger.error(f"Error getting last appointment data for {city}: {e}")
             return None
 
+    async def get_last_appointment_data_many(self, cities: Sequence[str], projection: Optional[Dict] = None) -> Dict[str, Dict]:
+        """Get the most recent appointment data for several cities in one query, keyed by city."""
+        try:
+            if projection is not None:
+                projection = {**projection, "city": 1}
+            cursor = self.db[self.appointments_collection].find(
+                {"city": {"$in": cities}},
+                projection,
+                sort=[("timestamp", 1)]
+            )
+            # Sorted oldest first so the newest document per city wins
+            return {doc["city"]: doc async for doc in cursor}
+        except Exception as e:
+            logger.error(f"Error getting last appointment data for cities {cities}: {e}")
+            return {}
+
     async def get_users_by_city(self, city: str) -> List[Dict]:
         """Get all users monitoring a specific city."""
         try:
@@ -243,6 +334,23 @@ class MongoDBClient:
             self.client.close()
             logger.info("MongoDB connection closed")
 
+    @staticmethod
+    def _is_subscription_active(user: Dict, current_time: datetime) -> bool:
+        """Check whether a user's subscription is still active at current_time."""
+        payment_date = parse_utc_timestamp(user["paymentDate"])
+        subscription_type = user["subscriptionType"]
+        
+        # Calculate subscription end date
+        if subscription_type == "monthly":
+            end_date = payment_date + timedelta(days=30)
+        elif subscription_type == "weekly":
+            end_date = payment_date + timedelta(days=7)
+        else:
+            logger.warning(f"Unknown subscription type {subscription_type} for user {user.get('email')}")
+            return False
+        
+        return current_time <= end_date
+
     async def get_active_subscriptions(self, city: str, country: str) -> List[Dict]:
         """Get all active subscriptions for a city and country combination."""
         try:
@@ -255,25 +363,9 @@ class MongoDBClient:
             })
             
             users = await cursor.to_list(length=None)
-            active_users = []
             
             # Filter users based on their subscription status
-            for user in users:
-                payment_date = datetime.fromisoformat(user["paymentDate"].replace("Z", "+00:00"))
-                subscription_type = user["subscriptionType"]
-                
-                # Calculate subscription end date
-                if subscription_type == "monthly":
-                    end_date = payment_date + timedelta(days=30)
-                elif subscription_type == "weekly":
-                    end_date = payment_date + timedelta(days=7)
-                else:
-                    logger.warning(f"Unknown subscription type {subscription_type} for user {user.get('email')}")
-                    continue
-                
-                # Check if subscription is still active
-                if current_time <= end_date:
-                    active_users.append(user)
+            active_users = [user for user in users if self._is_subscription_active(user, current_time)]
             
             logger.info(f"Found {len(active_users)} active subscriptions for {city}/{country}")
             return active_users
@@ -281,52 +373,100 @@ class MongoDBClient:
             logger.error(f"Error getting active subscriptions for {city}/{country}: {e}")
             return []
 
-    async def detect_slot_changes(self, city: str, current_data: Dict) -> List[Dict[str, Any]]:
+    async def get_active_subscriptions_by_city(self, cities: Sequence[str]) -> Dict[Tuple[str, str], List[Dict]]:
+        """
+        Get all active subscriptions for the given cities in a single query.
+        Returns active users keyed by (city, country).
+        """
+        try:
+            current_time = datetime.utcnow()
+            cursor = self.db[self.users_collection].find({"cityFrom": {"$in": cities}})
+            users = await cursor.to_list(length=None)
+            
+            subscriptions: Dict[Tuple[str, str], List[Dict]] = {}
+            for user in users:
+                try:
+                    if not self._is_subscription_active(user, current_time):
+                        continue
+                except (KeyError, AttributeError, ValueError) as e:
+                    logger.warning(f"Skipping user {user.get('email')} with invalid subscription data: {e}")
+                    continue
+                subscriptions.setdefault((user.get("cityFrom"), user.get("countryFrom")), []).append(user)
+            
+            logger.info(f"Found {sum(len(u) for u in subscriptions.values())} active subscriptions across {len(cities)} cities")
+            return subscriptions
+        except Exception as e:
+            logger.error(f"Error getting active subscriptions for cities {cities}: {e}")
+            return {}
+
+    @staticmethod
+    def _slot_change(city: str, country: str, change_type: str, current_slots: Any,
+                     previous_slots: Any, url: str, month: Optional[str] = None) -> Dict[str, Any]:
+        """Build a single slot change record."""
+        change = {
+            "city": city,
+            "country": country,
+            "change_type": change_type,
+            "current_slots": current_slots,
+            "previous_slots": previous_slots,
+            "url": url
+        }
+        if month is not None:
+            change["month"] = month
+        return change
+
+    async def detect_slot_changes(
+        self,
+        city: str,
+        current_data: Dict,
+        previous_data: Optional[Dict] = None
+    ) -> List[Dict[str, Any]]:
         """
         Detect changes in slot availability between current and previous data.
-        Returns a list of changes that need notifications.
+        previous_data may be preloaded with CHANGE_DETECTION_PROJECTION; it is
+        fetched when not given. Returns a list of changes that need notifications.
         """
         try:
-            previous_data = await self.get_last_appointment_data(city)
+            if previous_data is None:
+                previous_data = await self.get_last_appointment_data(city, self.CHANGE_DETECTION_PROJECTION)
             if not previous_data:
                 logger.info(f"No previous data found for {city}, skipping change detection")
                 return []
             
+            previous_keys = previous_data.get("available_slots")
+            if previous_keys is None:
+                # Snapshot saved before the vector existed; derive it from the full document
+                previous_data = await self.get_last_appointment_data(city)
+                previous_keys = availability_keys(previous_data.get("countries", []))
+            
             changes = []
             current_countries = {c["country"]: c for c in current_data.get("countries", [])}
-            previous_countries = {c["country"]: c for c in previous_data.get("countries", [])}
+            previous_countries = {c["country"] for c in previous_data.get("countries", [])}
+            newly_available = set(availability_keys(current_data.get("countries", []))).difference(previous_keys)
+            
+            base_url = current_data.get('base_url', '')
             
             # Check each country in current data
             for country_name, current_country in current_countries.items():
-                previous_country = previous_countries.get(country_name)
-                if not previous_country:
+                if country_name not in previous_countries:
                     # New country added
-                    if any(v is not None for v in current_country["slots"].values()):
-                        changes.append({
-                            "city": city,
-                            "country": country_name,
-                            "change_type": "new_country",
-                            "current_slots": current_country["slots"],
-                            "previous_slots": None,
-                            "url": f"{current_data.get('base_url', '')}/{country_name.lower().replace(' ', '-')}"
-                        })
+                    if any(v not in (None, "0") for v in current_country["slots"].values()):
+                        url = f"{base_url}/{country_slug(country_name)}"
+                        changes.append(self._slot_change(
+                            city, country_name, "new_country", current_country["slots"], None, url
+                        ))
+                    continue
+                
+                if not newly_available:
                     continue
                 
-                # Compare slots for each month
+                # Report each month whose slots became available
                 for month, current_slots in current_country["slots"].items():
-                    previous_slots = previous_country["slots"].get(month)
-                    
-                    # Check if slots became available
-                    if (previous_slots is None or previous_slots == "0") and current_slots not in (None, "0"):
-                        changes.append({
-                            "city": city,
-                            "country": country_name,
-                            "change_type": "slots_available",
-                            "month": month,
-                            "current_slots": current_slots,
-                            "previous_slots": previous_slots,
-                            "url": f"{current_data.get('base_url', '')}/{country_name.lower().replace(' ', '-')}"
-                        })
+                    if f"{country_name}|{month}" in newly_available:
+                        url = f"{base_url}/{country_slug(country_name)}"
+                        changes.append(self._slot_change(
+                            city, country_name, "slots_available", current_slots, None, url, month
+                        ))
             
             return changes
         except Exception as e:
@@ -1,16 +1,27 @@
 import os
-from typing import List, Dict
+import asyncio
+from typing import List, Dict, Optional
 from dataclasses import dataclass
 from datetime import datetime
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+import backoff
 from twilio.rest import Client
+from twilio.base.exceptions import TwilioRestException
 from dotenv import load_dotenv
 
 # Load environment variables from .env file only if they're not already set
 load_dotenv(override=False)
 
+def _is_permanent_smtp_error(e: Exception) -> bool:
+    """SMTP failures that retrying will not fix."""
+    return isinstance(e, (smtplib.SMTPAuthenticationError, smtplib.SMTPRecipientsRefused))
+
+def _is_permanent_twilio_error(e: TwilioRestException) -> bool:
+    """Twilio client errors other than rate limiting are not retried."""
+    return e.status is not None and 400 <= e.status < 500 and e.status != 429
+
 @dataclass
 class NotificationData:
     city: str
@@ -27,6 +38,7 @@ class NotificationService:
         self.smtp_port = int(os.getenv("SMTP_PORT", "587"))  # Namecheap uses port 587 for TLS
         self.smtp_username = os.getenv("SMTP_USERNAME")  # Your full email: notifications@visaslot.xyz
         self.smtp_password = os.getenv("SMTP_PASSWORD")  # Your email account password
+        self._smtp: Optional[smtplib.SMTP] = None  # Shared SMTP connection, opened on first send
         
         # Twilio settings
         self.twilio_account_sid = os.getenv("TWILIO_ACCOUNT_SID")
@@ -37,6 +49,134 @@ class NotificationService:
         self.twilio_client = None
         if all([self.twilio_account_sid, self.twilio_auth_token]):
             self.twilio_client = Client(self.twilio_account_sid, self.twilio_auth_token)
+        
+        # Background delivery queue, started on first enqueue
+        self.worker_count = int(os.getenv("NOTIFICATION_WORKERS", "2"))
+        self.queue_size = int(os.getenv("NOTIFICATION_QUEUE_SIZE", "500"))
+        # Longest a flush waits for queued deliveries, so a down provider cannot block the caller
+        self.flush_timeout = float(os.getenv("NOTIFICATION_FLUSH_TIMEOUT", "120"))
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        
+        # SMTP and Twilio clients block, so sends run in threads: one at a time on the
+        # shared SMTP connection, and a bounded number of concurrent Twilio requests
+        self._smtp_lock = asyncio.Lock()
+        self._sms_semaphore = asyncio.Semaphore(int(os.getenv("NOTIFICATION_SMS_CONCURRENCY", "4")))
+
+    def _get_smtp(self) -> smtplib.SMTP:
+        """Return the shared SMTP connection, reconnecting if it was dropped."""
+        if self._smtp is not None:
+            try:
+                self._smtp.noop()
+                return self._smtp
+            except (smtplib.SMTPException, OSError):
+                self._close_smtp()
+        
+        server = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=30)
+        server.starttls()
+        server.login(self.smtp_username, self.smtp_password)
+        self._smtp = server
+        return server
+
+    def _close_smtp(self) -> None:
+        """Close the shared SMTP connection if one is open."""
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
+        finally:
+            self._smtp = None
+
+    async def enqueue(self, email: str, phone: str, data: NotificationData) -> None:
+        """Queue a user notification for background delivery.
+
+        The queue is bounded so a slow mail or SMS provider cannot grow it without
+        limit; when it is full the caller waits for the workers to make room, so
+        no notification is dropped.
+        """
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+        await self._queue.put((email, phone, data))
+
+    async def _worker(self) -> None:
+        """Deliver queued notifications until cancelled."""
+        while True:
+            email, phone, data = await self._queue.get()
+            try:
+                await self.notify_user(email, phone, data)
+            except Exception as e:
+                print(f"Error delivering notification to {email}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued notification has been delivered.
+
+        Returns False if timeout seconds pass first; undelivered notifications stay queued.
+        """
+        if self._queue is None:
+            return True
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def close(self) -> None:
+        """Deliver pending notifications, stop the workers and release resources.
+
+        Delivery is bounded by flush_timeout; anything still queued after that is discarded.
+        """
+        if not await self.flush(self.flush_timeout):
+            print(f"Notification delivery did not finish within {self.flush_timeout:.0f}s, "
+                  f"discarding {self._queue.qsize()} queued notifications")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        self._close_smtp()
+
+    @backoff.on_exception(
+        backoff.expo,
+        (smtplib.SMTPException, OSError),
+        max_tries=3,
+        max_time=60,
+        giveup=_is_permanent_smtp_error
+    )
+    async def _deliver_email(self, message: MIMEMultipart) -> None:
+        """Send a message over the shared SMTP connection, retrying transient failures."""
+        async with self._smtp_lock:
+            await asyncio.to_thread(self._send_smtp, message)
+
+    def _send_smtp(self, message: MIMEMultipart) -> None:
+        """Blocking send on the shared SMTP connection; run in a worker thread."""
+        try:
+            self._get_smtp().send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            # Drop the stale connection so the retry reconnects
+            self._close_smtp()
+            raise
+
+    @backoff.on_exception(
+        backoff.expo,
+        TwilioRestException,
+        max_tries=3,
+        max_time=60,
+        giveup=_is_permanent_twilio_error
+    )
+    async def _deliver_sms(self, body: str, to_phone: str) -> None:
+        """Send an SMS through Twilio, retrying rate limits and server errors."""
+        async with self._sms_semaphore:
+            await asyncio.to_thread(
+                self.twilio_client.messages.create,
+                body=body,
+                from_=self.twilio_from_number,
+                to=to_phone
+            )
 
     async def send_email(self, to_email: str, data: NotificationData) -> bool:
         """Send email notification."""
@@ -49,10 +189,7 @@ class NotificationService:
             # Use the pre-formatted message
             message.attach(MIMEText(data.message, "plain"))
             
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.smtp_username, self.smtp_password)
-                server.send_message(message)
+            await self._deliver_email(message)
             
             return True
         except Exception as e:
@@ -72,25 +209,20 @@ class NotificationService:
             if len(sms_message) > 1000:
                 sms_message = sms_message[:997] + "..."
                 
-            self.twilio_client.messages.create(
-                body=sms_message,
-                from_=self.twilio_from_number,
-                to=to_phone
-            )
+            await self._deliver_sms(sms_message, to_phone)
             return True
         except Exception as e:
             print(f"Error sending SMS: {e}")
             return False
 
     async def notify_user(self, email: str, phone: str, data: NotificationData) -> None:
-        """Send notifications to a user through both email and SMS."""
-        email_sent = False
-        sms_sent = False
-        
-        if email:
-            email_sent = await self.send_email(email, data)
+        """Send notifications to a user through email and SMS concurrently."""
+        async def skipped() -> bool:
+            return False
         
-        if phone:
-            sms_sent = await self.send_sms(phone, data)
+        email_sent, sms_sent = await asyncio.gather(
+            self.send_email(email, data) if email else skipped(),
+            self.send_sms(phone, data) if phone else skipped()
+        )
         
         print(f"Notifications sent - Email: {email_sent}, SMS: {sms_sent}") 
\ No newline at end of file
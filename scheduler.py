@@ -1,16 +1,15 @@
 #!/usr/bin/env python3
 
 import asyncio
+from contextlib import asynccontextmanager
 import signal
 import sys
 import time
 from datetime import datetime
-import schedule
 from loguru import logger
-import threading
 import os
 
-from crawl import SchengenAppointmentCrawler
+from crawl import SchengenAppointmentCrawler, uvloop
 
 # Configure logging
 os.makedirs("logs", exist_ok=True)
@@ -18,21 +17,30 @@ logger.add(
     "logs/scheduler_{time:YYYY-MM-DD}.log",
     rotation="00:00",  # Rotate at midnight
     retention="7 days",
-    level="INFO"
+    level="INFO",
+    enqueue=True  # Write from a background thread so logging never blocks the event loop
 )
 
 class CrawlerScheduler:
     def __init__(self):
         self.is_running = False
-        self.current_task = None
+        self.main_task = None
         self.crawler = None
-        self.loop = None
+        self.interval = float(os.getenv("CRAWLER_INTERVAL", "60"))
+        self.cycle_timeout = float(os.getenv("CRAWLER_CYCLE_TIMEOUT", "300"))
+        self.cleanup_interval = float(os.getenv("CRAWLER_CLEANUP_INTERVAL", "3600"))
+        self._cycle_lock = asyncio.Lock()
+        self._stop_event = asyncio.Event()
+        # Relaunch the browser after this many iterations to bound Chromium's memory growth
+        self.recycle_every = int(os.getenv("CRAWLER_RECYCLE_EVERY", "360"))
+        self._iterations_since_setup = 0
         
     async def initialize_crawler(self):
         """Initialize the crawler if not already initialized."""
         try:
             if self.crawler is None:
                 self.crawler = SchengenAppointmentCrawler()
+                self._iterations_since_setup = 0
                 await self.crawler.setup()
                 logger.info("Crawler initialized successfully")
         except Exception as e:
@@ -50,124 +58,134 @@ class CrawlerScheduler:
             logger.error(f"Error during crawler cleanup: {e}")
 
     async def run_crawler_task(self):
-        """Run a single crawler iteration."""
+        """Run a single crawler iteration, skipping it if one is already running."""
+        if self._cycle_lock.locked():
+            logger.warning("Previous crawler task still running, skipping this iteration")
+            return
+
+        async with self._cycle_lock:
+            await self._run_crawler_iteration()
+
+    @asynccontextmanager
+    async def crawler_session(self):
+        """Yield an initialized crawler, recycling it if setup fails or its browser is gone."""
         try:
-            if not self.crawler:
-                await self.initialize_crawler()
-            
-            logger.info("Starting crawler iteration")
-            start_time = time.time()
-            
-            await self.crawler.crawl_cities()
+            await self.initialize_crawler()
+            yield self.crawler
+        except Exception as e:
+            # Transient page or database errors leave the browser usable; only a dead,
+            # hung or half-initialized crawler is torn down so the next iteration relaunches it
+            if self.crawler is None or isinstance(e, asyncio.TimeoutError) or not self.crawler.is_healthy():
+                await self.cleanup_crawler()
+            raise
+
+    async def _run_crawler_iteration(self):
+        """Run the crawler once and recover from failures."""
+        try:
+            async with self.crawler_session() as crawler:
+                logger.info("Starting crawler iteration")
+                start_time = time.time()
+                
+                # Cancel a hung cycle instead of letting it hold the crawler indefinitely
+                await asyncio.wait_for(crawler.crawl_cities(), timeout=self.cycle_timeout)
+                
+                duration = time.time() - start_time
+                logger.info(f"Completed crawler iteration in {duration:.2f} seconds")
+                
+                # Deliver this cycle's notifications outside the crawl timeout: a slow mail or
+                # SMS provider is not a hung browser, so it must not cause a crawler recycle
+                notifications = crawler.notification_service
+                if not await notifications.flush(notifications.flush_timeout):
+                    logger.warning(
+                        f"Notifications still pending after {notifications.flush_timeout:.0f} seconds, "
+                        "delivering them in the background"
+                    )
             
-            duration = time.time() - start_time
-            logger.info(f"Completed crawler iteration in {duration:.2f} seconds")
+            # Reuse the browser across iterations, recycling it only after recycle_every runs
+            self._iterations_since_setup += 1
+            if self.recycle_every > 0 and self._iterations_since_setup >= self.recycle_every:
+                logger.info(f"Recycling crawler after {self._iterations_since_setup} iterations")
+                await self.cleanup_crawler()
             
+        except asyncio.TimeoutError:
+            logger.error(f"Crawler iteration timed out after {self.cycle_timeout:.0f} seconds")
         except Exception as e:
             logger.error(f"Error during crawler iteration: {e}")
-            # Cleanup and reinitialize on error
-            await self.cleanup_crawler()
         finally:
             # Brief pause to prevent immediate restart
             await asyncio.sleep(1)
 
-    def run_crawler_sync(self):
-        """Synchronous wrapper for the crawler task."""
-        try:
-            if self.current_task and not self.current_task.done():
-                logger.warning("Previous crawler task still running, skipping this iteration")
-                return
-
-            if self.loop is None or self.loop.is_closed():
-                self.loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(self.loop)
-
-            # Run the crawler task
-            self.current_task = self.loop.create_task(self.run_crawler_task())
-            self.loop.run_until_complete(self.current_task)
-
-        except Exception as e:
-            logger.error(f"Error in crawler sync wrapper: {e}")
-            # Reset task on error
-            self.current_task = None
-            
-            # Cleanup loop on error
-            if self.loop and not self.loop.is_closed():
-                self.loop.close()
-                self.loop = None
+    async def run_cleanup_task(self):
+        """Delete appointment records older than the retention window."""
+        if self.crawler is None:
+            return
+        deleted_count = await self.crawler.mongodb.cleanup_old_data()
+        if deleted_count > 0:
+            logger.info(f"Hourly cleanup removed {deleted_count} old records")
 
-    def schedule_runner(self):
-        """Run scheduled tasks in a separate thread."""
-        while self.is_running:
-            schedule.run_pending()
-            time.sleep(1)
+    async def run(self):
+        """Run a crawler iteration every interval until stopped.
 
-    def start(self):
-        """Start the scheduler."""
+        Iterations are timed on the monotonic clock, so the next run is scheduled
+        from when the previous one was due rather than polled for every second.
+        """
+        self.main_task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop, sig)
+        
+        self.is_running = True
+        logger.info(f"Scheduler started, running every {self.interval:.0f} seconds")
+        
+        next_run = time.monotonic()
+        next_cleanup = next_run + self.cleanup_interval
         try:
-            self.is_running = True
-            
-            # Schedule the job to run every minute
-            schedule.every(1).minutes.do(self.run_crawler_sync)
-            
-            # Run immediately on start
-            self.run_crawler_sync()
-            
-            logger.info("Scheduler started")
-            
-            # Start scheduler in a separate thread
-            scheduler_thread = threading.Thread(target=self.schedule_runner)
-            scheduler_thread.daemon = True
-            scheduler_thread.start()
-            
-            # Keep main thread alive
             while self.is_running:
-                time.sleep(1)
+                await self.run_crawler_task()
                 
-        except Exception as e:
-            logger.error(f"Error in scheduler: {e}")
+                # Retention cleanup rides the same loop rather than waiting for a teardown
+                if time.monotonic() >= next_cleanup:
+                    await self.run_cleanup_task()
+                    next_cleanup = time.monotonic() + self.cleanup_interval
+                
+                next_run += self.interval
+                now = time.monotonic()
+                if next_run < now:
+                    # The iteration overran the interval; start the next one now instead of bursting
+                    next_run = now
+                
+                # Idle until the next run is due or a stop is requested
+                try:
+                    await asyncio.wait_for(self._stop_event.wait(), timeout=next_run - now)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            pass
+        finally:
             self.is_running = False
-            raise
+            await self.cleanup_crawler()
+            logger.info("Scheduler stopped")
 
-    def stop(self):
-        """Stop the scheduler and cleanup resources."""
-        self.is_running = False
+    def start(self):
+        """Start the scheduler and block until it is stopped."""
+        asyncio.run(self.run())
+
+    def stop(self, signum=None):
+        """Stop the scheduler; a running iteration is cancelled and the crawler cleaned up."""
+        if signum is not None:
+            logger.info(f"Received signal {signum}")
         
-        if self.loop and not self.loop.is_closed():
-            try:
-                # Cancel current task if running
-                if self.current_task and not self.current_task.done():
-                    self.current_task.cancel()
-                    self.loop.run_until_complete(self.current_task)
-                
-                # Run cleanup
-                self.loop.run_until_complete(self.cleanup_crawler())
-                
-                # Close the loop
-                self.loop.close()
-            except Exception as e:
-                logger.error(f"Error during scheduler stop: {e}")
-            finally:
-                self.loop = None
-                self.current_task = None
+        self.is_running = False
+        self._stop_event.set()
         
-        logger.info("Scheduler stopped")
-
-def signal_handler(signum, frame):
-    """Handle termination signals."""
-    logger.info(f"Received signal {signum}")
-    
-    try:
-        scheduler.stop()
-    except Exception as e:
-        logger.error(f"Error during signal handling: {e}")
-    finally:
-        sys.exit(0)
+        # Between iterations the event wakes the loop; an in-flight iteration is cancelled
+        if self._cycle_lock.locked() and self.main_task and not self.main_task.done():
+            self.main_task.cancel()
 
 if __name__ == "__main__":
-    # Register signal handlers
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+    # Use the libuv event loop when it is available
+    if uvloop is not None:
+        uvloop.install()
     
     # Create and start the scheduler
     scheduler = CrawlerScheduler()
@@ -176,5 +194,4 @@ if __name__ == "__main__":
         scheduler.start()
     except Exception as e:
         logger.error(f"Scheduler error: {e}")
-        scheduler.stop()
-        sys.exit(1) 
\ No newline at end of file
+        sys.exit(1)